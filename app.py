@@ -1,4 +1,11 @@
+import os
+import json
+import operator
 import itertools as it
+import threading
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 import numpy as np
 import pandas as pd
@@ -29,8 +36,23 @@ ave_p = pd.read_table('data/pagel_pvalue_featureVsHabitat.csv', sep=',', index_c
 
 node_items = [{'label': col, 'value': col} for col in ava_lr.columns]
 
+# Heatmap matrices, keyed by the dataset-select value. If cluster_matrices.py
+# has been run, reorder them once here so the callback pays nothing for it.
+heatmap_frames = {'1': (ava_lr, ave_lr),
+                  '2': (ava_p, ave_p),}
+if os.path.exists('data/matrix_order.json'):
+    with open('data/matrix_order.json') as fh:
+        matrix_order = json.load(fh)
+    for key, (ava, ave) in heatmap_frames.items():
+        if key in matrix_order:
+            order = matrix_order[key]
+            heatmap_frames[key] = (apply_order(ava, order['rows'], order['ava_cols']),
+                                   apply_order(ave, order['rows'], order['ave_cols']))
+
 
 G = nx.graphml.read_graphml('data/pagel_results_as_network_updated.graphml')
+# Integer index of G for path queries, built once and only read afterwards.
+path_index = build_path_index(G)
 default_stylesheet = [
                         {
                             'selector':'edge',
@@ -61,8 +83,70 @@ default_stylesheet = [
                                 'content': 'data(label)',
                             },
                         },
+                        {'selector': 'node.path',
+                            'style':{
+                                'border-color': '#FF851B',
+                                'border-width': 3,
+                            },
+                        },
+                        {'selector': 'edge.path',
+                            'style':{
+                                'line-color': '#FF851B',
+                                'opacity': 0.9,
+                                'z-index': 4000,
+                            },
+                        },
                         ]
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.SOLAR],suppress_callback_exceptions=True)
+# WSGI entry point for production serving, e.g. `gunicorn -c gunicorn.conf.py app:server`.
+server = app.server
+
+# Pool for CPU heavy callbacks, one per server process. Its processes are
+# forked so they share G and the matrices copy-on-write instead of pickling
+# them. Start it with init_pool before the server starts any threads, as
+# forking a threaded process can deadlock; gunicorn does so in post_fork.
+pool = None
+pool_lock = threading.Lock()
+# Called once if the pool breaks. gunicorn sets it to retire the worker, so a
+# fresh one with a new pool replaces it.
+on_pool_broken = None
+pool_start_barrier = None
+
+def wait_for_pool_start():
+    pool_start_barrier.wait(timeout=60)
+
+def init_pool(max_workers=None):
+    global pool, pool_start_barrier
+    if max_workers is None:
+        max_workers = int(os.environ.get('PAGEL2GRAPH_POOL_WORKERS', os.cpu_count() or 1))
+    context = mp.get_context('fork')
+    pool_start_barrier = context.Barrier(max_workers)
+    pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=context)
+    # Python < 3.12 forks pool processes on demand, one per submit while none
+    # is idle. Holding every task at a barrier keeps them all busy, so every
+    # process is forked here rather than later from a request thread.
+    for future in [pool.submit(wait_for_pool_start) for _ in range(max_workers)]:
+        future.result()
+    return pool
+
+#Run fn(*args) for each args in calls and return the results. Uses the pool
+#when there is one, else runs in this process; it never forks, since it is
+#called from request threads. A broken pool (e.g. a process was OOM killed)
+#is dropped and the calls are run here instead.
+def run_in_pool(fn, calls):
+    global pool
+    current = pool
+    if current is not None:
+        try:
+            futures = [current.submit(fn, *args) for args in calls]
+            return [future.result() for future in futures]
+        except BrokenProcessPool:
+            with pool_lock:
+                if pool is current:
+                    pool = None
+                    if on_pool_broken is not None:
+                        on_pool_broken()
+    return [fn(*args) for args in calls]
 
 
 ################################################################################
@@ -207,6 +291,39 @@ page2_layout = dbc.Container(fluid=True, children=[
                                     type='number', min=0, value=0.05),
                             dbc.FormText("p-value upper bound")
                         ]),
+                        dbc.Col([
+                            dbc.Label('Find paths to a second node (optional).'),
+                            dcc.Dropdown(
+                                id='path-target-dropdown',
+                                options=node_items,
+                                value=None,
+                                placeholder='Path target',
+                                className="bg-light text-dark"),
+                            dbc.FormText('Path target'),
+                            dcc.Dropdown(
+                                id='path-weight',
+                                value='p',
+                                clearable=False,
+                                options=[
+                                    {'label': 'Strongest association (1 / -log10 p)', 'value': 'p'},
+                                    {'label': 'Strongest association (1 / LR)', 'value': 'lr'},
+                                    {'label': 'Fewest hops', 'value': 'hops'},
+                                ],
+                                className="bg-light text-dark"),
+                            dbc.FormText('Path ranking'),
+                            dbc.Input(
+                                    id='n-paths',
+                                    placeholder='Number of paths',
+                                    type='number', min=1, step=1, value=3
+                                    ),
+                            dbc.FormText('Number of paths'),
+                            dbc.Input(
+                                    id='path-max-hops',
+                                    placeholder='Maximum path length',
+                                    type='number', min=1, step=1, value=4
+                                    ),
+                            dbc.FormText('Maximum path length'),
+                        ]),
                     ]),
 
                     dbc.Button('Update iPlot', id='interactive-button', color='success', style={'margin-bottom': '1em'}, block=True),
@@ -280,9 +397,6 @@ page3_layout = dbc.Container(fluid=True, children=[
     [Input('dataset-select', 'value'),]
 )
 def plot(dataset):
-    df_map = {'1': (ava_lr, ave_lr),
-              '2': (ava_p, ave_p),}
-
     colorbar_map = {'1': dict(
                     tick0=0,
                     dtick=50,
@@ -311,7 +425,7 @@ def plot(dataset):
     z_bounds_map = {'1': (-10, 250),
                     '2': (0, 1.0)}
 
-    ava, ave = df_map[str(dataset)]
+    ava, ave = heatmap_frames[str(dataset)]
     zmin, zmax = z_bounds_map[str(dataset)]
     colorbar = colorbar_map[str(dataset)]
     colorscale = colorscale_map[str(dataset)]
@@ -382,6 +496,11 @@ def update_layout(layout):
         'animate': True
     }
 
+#Path query for update_elements. Runs in the process pool.
+def find_paths(node, target, lr_threshold, p_threshold, k, weight, max_hops):
+    return k_shortest_paths(path_index, node, target, k=k, weight=weight, max_hops=max_hops,
+                            lr_threshold=lr_threshold, p_threshold=p_threshold)
+
 @app.callback(
     Output('network-plot', 'elements'),
     Output('node-selected', 'children'),
@@ -389,14 +508,27 @@ def update_layout(layout):
      State('node-dropdown', 'value'),
      State('degree', 'value'),
      State('lr-threshold', 'value'),
-     State('p-threshold', 'value'),]
+     State('p-threshold', 'value'),
+     State('path-target-dropdown', 'value'),
+     State('path-weight', 'value'),
+     State('n-paths', 'value'),
+     State('path-max-hops', 'value'),]
 )
-def update_elements(click, node, degree, lr_threshold, p_threshold):
+def update_elements(click, node, degree, lr_threshold, p_threshold, target, path_weight, n_paths, path_max_hops):
     n_nodes = 0
     n_edges = 0
     H = filter_graph(G, node, degree, lr_threshold, p_threshold)
+    # Paths to the target are shown on top of the neighborhood.
+    paths = []
+    if target:
+        paths, = run_in_pool(find_paths, [(node, target, lr_threshold, p_threshold,
+                                           n_paths or 1, path_weight, path_max_hops or 1)])
+    path_nodes, path_edges = path_elements(paths)
+    if paths:
+        # Only the edges among the shown nodes need thresholding here.
+        H = threshold_graph(G.subgraph(set(H.nodes) | path_nodes), lr_threshold, p_threshold)
     # Graph basics
-    elements = nx_to_dash(H, node)
+    elements = nx_to_dash(H, node, path_nodes, path_edges)
     n_nodes = len(H.nodes)
     n_edges = len(H.edges)
 
@@ -412,6 +544,12 @@ def update_elements(click, node, degree, lr_threshold, p_threshold):
             dbc.ListGroupItem("n Edges: {}".format(n_edges)),
         ],
     )
+    if target:
+        path_items = [dbc.ListGroupItem("Path {0} (cost {1:.4g}): {2}".format(rank, cost, ' -> '.join(path)))
+                      for rank, (cost, path) in enumerate(paths, 1)]
+        if not path_items:
+            path_items = [dbc.ListGroupItem("No path to {} within the thresholds.".format(target))]
+        summary = html.Div([summary, dbc.ListGroup(path_items)])
     return elements, summary
 @app.callback(Output('network-plot', 'stylesheet'),
             [Input('network-plot', 'tapNode')])
@@ -450,6 +588,19 @@ def highlight_edges(node):
                                 'content': 'data(label)',
                             },
                         },
+                        {'selector': 'node.path',
+                            'style':{
+                                'border-color': '#FF851B',
+                                'border-width': 3,
+                            },
+                        },
+                        {'selector': 'edge.path',
+                            'style':{
+                                'line-color': '#FF851B',
+                                'opacity': 0.9,
+                                'z-index': 4000,
+                            },
+                        },
                         {
                             "selector": 'node[id = "{}"]'.format(node['data']['id']),
                             "style": {
@@ -497,6 +648,35 @@ def highlight_edges(node):
 ################################################################################
 ### Network Visualization Callbacks                                          ###
 ################################################################################
+#Node neighborhood sizes in G thresholded on both metrics. Runs in the process
+#pool, where G is inherited from the parent through fork rather than pickled.
+def histogram_records(dynamic_metric, dynamic_threshold, static_metric, static_threshold):
+    passes = {'lr': operator.ge, 'p': operator.le}
+    dfun = passes[dynamic_metric]
+    sfun = passes[static_metric]
+
+    F= nx.Graph()
+    F.add_nodes_from((node, {**G.nodes[node]}) for node in G.nodes)
+
+    edges = []
+    for u,v,e in G.edges(data=True):
+        if dfun(e[dynamic_metric], dynamic_threshold) and sfun(e[static_metric], static_threshold):
+            edges.append((u,v, e))
+
+    F.add_edges_from(edges)
+
+    records = []
+    graph_degree = F.degree()
+    for node in F.nodes:
+        Sub = F.subgraph(neighborhood(F, node, 2))
+        records.append({'node': node,
+                        'node_degree': graph_degree[node],
+                        'n_nodes': len(Sub.nodes),
+                        'n_edges': len(Sub.edges),
+                        dynamic_metric: dynamic_threshold,
+                        static_metric: static_threshold,})
+    return records
+
 @app.callback(
     Output('histogram-graph', 'figure'),
     [Input('histogram-button', 'n_clicks'),
@@ -517,53 +697,21 @@ def show_histogram(click, metric_sel, y_sel):
     y = y_map[str(y_sel)]
 
 
-    lte = lambda x,y: x<=y
-    gte = lambda x,y: x>=y
-
     if dynamic_metric == 'lr':
         search = [25, 50, 100, 150]
-        dfun = gte
-        sfun = lte
-
     else:
         search = [0.05, 1e-5, 1e-9, 1e-12]
-        dfun = lte
-        sfun = gte
 
     if static_metric == 'p':
         static_threshold = 0.05
     else:
         static_threshold = 50
 
-    records = []
-    node_list = []
-    for node in G.nodes:
-        node_list.append((node, {**G.nodes[node]}))
-
-    for dynamic_threshold in search:
-        F= nx.Graph()
-        F.add_nodes_from(node_list)
-
-        edges = []
-        for u,v,e in G.edges(data=True):
-            if dfun(e[dynamic_metric], dynamic_threshold) and sfun(e[static_metric], static_threshold):
-            #if e['lr'] >= lr_threshold and e['p'] <= p_threshold:
-                edges.append((u,v, e))
-
-        F.add_edges_from(edges)
-
-        graph_degree = F.degree()
-        for i, node in enumerate(F.nodes):
-            Sub = F.subgraph(neighborhood(F, node, 2))
-            n_nodes = len(Sub.nodes)
-            n_edges = len(Sub.edges)
-
-            records.append({'node': node,
-                            'node_degree': graph_degree[node],
-                            'n_nodes': n_nodes,
-                            'n_edges': n_edges,
-                            dynamic_metric: dynamic_threshold,
-                            static_metric: static_threshold,})
+    # One task per threshold, run in the process pool.
+    results = run_in_pool(histogram_records, [(dynamic_metric, dynamic_threshold,
+                                               static_metric, static_threshold)
+                                              for dynamic_threshold in search])
+    records = [record for result in results for record in result]
 
     rdf = pd.DataFrame.from_records(records)
     plot = px.histogram(rdf, x='node', y=y, facet_col=dynamic_metric)
@@ -595,4 +743,5 @@ def display_page(pathname):
 
 
 if __name__ == '__main__':
+    init_pool()
     app.run_server(debug=True)
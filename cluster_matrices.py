@@ -0,0 +1,36 @@
+import json
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from utils import cluster_matrices
+
+argparser = argparse.ArgumentParser(description='Precompute hierarchical clustering orders for the LR and p-value heatmaps.')
+argparser.add_argument('--ava-lr', help='Feature vs feature LR matrix.', default='data/efaecium_profile_LR_rerunNA.csv')
+argparser.add_argument('--ava-p', help='Feature vs feature p-value matrix.', default='data/efaecium_profile_pval_rerunNA.csv')
+argparser.add_argument('--ave-lr', help='Feature vs habitat LR matrix.', default='data/pagel_LR_featureVsHabitat.csv')
+argparser.add_argument('--ave-p', help='Feature vs habitat p-value matrix.', default='data/pagel_pvalue_featureVsHabitat.csv')
+argparser.add_argument('--method', help='Linkage method passed to scipy.', default='average')
+argparser.add_argument('--chunk-size', help='Rows per block of the distance computation.', default=500, type=int)
+argparser.add_argument('-o', help='Path for output file.', default='data/matrix_order.json')
+
+if __name__=='__main__':
+    args = argparser.parse_args()
+
+    ava_lr = pd.read_table(args.ava_lr, sep=',', index_col=0)
+    ava_p = pd.read_table(args.ava_p, sep=',', index_col=0)
+    ave_lr = pd.read_table(args.ave_lr, sep=',', index_col=0)
+    ave_p = pd.read_table(args.ave_p, sep=',', index_col=0)
+
+    #p-values are clustered on -log10(p) so the small, interesting values
+    #drive the distances rather than the bulk of values near 1.
+    to_log = lambda df: -np.log10(df.clip(lower=1e-300))
+
+    orders = {
+        '1': cluster_matrices(ava_lr, ave_lr, args.method, args.chunk_size),
+        '2': cluster_matrices(to_log(ava_p), to_log(ave_p), args.method, args.chunk_size),
+    }
+
+    with open(args.o, 'w') as fh:
+        json.dump(orders, fh)
@@ -1,6 +1,8 @@
 import networkx as nx
 import argparse
 
+from utils import build_path_index, k_shortest_paths, path_elements, path_weights
+
 argparser = argparse.ArgumentParser(description='Filter GraphML file to explore relationships.')
 requiredNamed = argparser.add_argument_group('required named arguments')
 requiredNamed.add_argument('-i', help='Input GraphML file.', required=True)
@@ -9,6 +11,10 @@ requiredNamed.add_argument('-d', help='Degree of neighborhood from node of inter
 requiredNamed.add_argument('-lr', help='Likelihood ratio threshold. Edges below this value will be excluded.', required=True, type=float)
 requiredNamed.add_argument('-p', help='P-value ratio threshold. Edges above this value will be excluded.', required=True, type=float)
 requiredNamed.add_argument('-o', help='Path for output file.', required=True)
+pathArgs = argparser.add_argument_group('path extraction arguments')
+pathArgs.add_argument('-t', help='Target node. If given, extract the paths from the node of interest to this node instead of its neighborhood. -d is then the maximum path length.')
+pathArgs.add_argument('-k', help='Number of paths to extract, cheapest first.', default=1, type=int)
+pathArgs.add_argument('-w', help='Edge cost used to rank paths. "lr" uses 1/LR and "p" uses 1/-log10(p), so the cheapest path is the strongest chain of associations.', default='p', choices=list(path_weights))
 
 #Function uses dijkstra to calculate paths through the graph.
 #Given a node and a degree, returns the nodes within degree n
@@ -35,6 +41,14 @@ if __name__=='__main__':
         print("Node {} was not found in the graph. Please double check spelling of the node and file path.")
         exit()
 
+    if args.t is not None and args.t not in G.nodes:
+        print("Node {} was not found in the graph. Please double check spelling of the node and file path.".format(args.t))
+        exit()
+
+    if args.t == node:
+        print("The target node must differ from the node of interest.")
+        exit()
+
     edges = []
     for u,v,e in G.edges(data=True):
         if e['lr'] >= lr_threshold and e['p'] <= p_threshold:
@@ -42,6 +56,21 @@ if __name__=='__main__':
 
     H = G.edge_subgraph(edges)
 
+    if args.t is not None:
+        paths = k_shortest_paths(build_path_index(G), node, args.t, k=args.k, weight=args.w,
+                                 max_hops=degree, lr_threshold=lr_threshold, p_threshold=p_threshold)
+        if not paths:
+            print("No path of length {0} or less was found between {1} and {2} in the filtered graph.".format(degree, node, args.t))
+            print("Try specifying a different node or different thresholds.")
+            exit()
+        for rank, (cost, path) in enumerate(paths, 1):
+            print("{0}\t{1:.4g}\t{2}".format(rank, cost, ' -> '.join(path)))
+        path_nodes, path_edges = path_elements(paths)
+        # Paths ignore edge direction, so keep either orientation present in H.
+        path_edges |= {(v, u) for u, v in path_edges}
+        nx.readwrite.graphml.write_graphml(H.edge_subgraph(path_edges), outpath)
+        exit()
+
     try:
         selected = neighborhood(H, node, degree)
     except:
@@ -0,0 +1,33 @@
+# Production serving for the Dash app:
+#   gunicorn -c gunicorn.conf.py app:server
+# The graph and matrices are loaded once in the master process (preload_app)
+# and shared with the workers copy-on-write through fork. Callbacks only read
+# them, so the pages stay shared.
+import gc
+import os
+
+bind = os.environ.get('PAGEL2GRAPH_BIND', '0.0.0.0:8050')
+# Workers and their callback pools are sized together: the CPU heavy work
+# runs in the pools, so by default a few workers split the cores between
+# their pools. Each worker is 1 + pool_workers processes.
+workers = int(os.environ.get('PAGEL2GRAPH_WORKERS', 2))
+pool_workers = int(os.environ.get('PAGEL2GRAPH_POOL_WORKERS', max(1, (os.cpu_count() or 1) // workers)))
+# Threads let a worker keep serving while its long callbacks wait on the pool.
+worker_class = 'gthread'
+threads = int(os.environ.get('PAGEL2GRAPH_THREADS', 4))
+preload_app = True
+timeout = 300
+
+def when_ready(server):
+    # Runs in the master after the app is loaded and before any fork. Frozen
+    # objects are skipped by the cyclic GC, so collections in the workers do
+    # not write to (and so copy) the shared pages.
+    gc.freeze()
+
+def post_fork(server, worker):
+    # Start the callback pool while the worker is still single threaded.
+    import app
+    app.init_pool(pool_workers)
+    # If the pool breaks, finish the requests in flight and exit; the master
+    # then starts a replacement worker with a new pool.
+    app.on_pool_broken = lambda: setattr(worker, 'alive', False)
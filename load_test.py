@@ -0,0 +1,182 @@
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import random
+import argparse
+import tempfile
+import subprocess
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import networkx as nx
+
+argparser = argparse.ArgumentParser(description='Measure Dash callbacks per second on a synthetic dataset.')
+argparser.add_argument('--url', help='Server to test, run from the current directory. If not given, a synthetic dataset is generated and a server is started on it.')
+argparser.add_argument('--server', help='Server to start when --url is not given.', default='gunicorn', choices=['gunicorn', 'dev'])
+argparser.add_argument('--callback', help='Callback to exercise.', default='network', choices=['network', 'paths', 'heatmap', 'histogram'])
+argparser.add_argument('--nodes', help='Number of features in the synthetic dataset.', default=500, type=int)
+argparser.add_argument('--habitats', help='Number of habitats in the synthetic dataset.', default=10, type=int)
+argparser.add_argument('--edge-prob', help='Probability of an edge between two features.', default=0.02, type=float)
+argparser.add_argument('--requests', help='Total number of callback requests.', default=200, type=int)
+argparser.add_argument('--concurrency', help='Number of concurrent clients.', default=8, type=int)
+argparser.add_argument('--seed', default=0, type=int)
+
+REPO = os.path.dirname(os.path.abspath(__file__))
+
+#Write the files app.py expects into root/data.
+def make_dataset(root, n_nodes, n_habitats, edge_prob, seed):
+    rng = np.random.default_rng(seed)
+    features = ['feature_{}'.format(i) for i in range(n_nodes)]
+    habitats = ['habitat_{}'.format(i) for i in range(n_habitats)]
+
+    lr = rng.exponential(40, (n_nodes, n_nodes))
+    lr = np.triu(lr, 1) + np.triu(lr, 1).T
+    p = np.exp(-lr / 10)
+    # Missing cells, as in the rerunNA files.
+    missing = np.triu(rng.random((n_nodes, n_nodes)) < 0.05, 1)
+    missing = missing | missing.T
+    np.fill_diagonal(missing, True)
+    lr[missing] = np.nan
+    p[missing] = np.nan
+
+    habitat_lr = rng.exponential(40, (n_nodes, n_habitats))
+    habitat_p = np.exp(-habitat_lr / 10)
+
+    data = os.path.join(root, 'data')
+    os.makedirs(data, exist_ok=True)
+    pd.DataFrame(lr, index=features, columns=features).to_csv(os.path.join(data, 'efaecium_profile_LR_rerunNA.csv'))
+    pd.DataFrame(p, index=features, columns=features).to_csv(os.path.join(data, 'efaecium_profile_pval_rerunNA.csv'))
+    pd.DataFrame(habitat_lr, index=features, columns=habitats).to_csv(os.path.join(data, 'pagel_LR_featureVsHabitat.csv'))
+    pd.DataFrame(habitat_p, index=features, columns=habitats).to_csv(os.path.join(data, 'pagel_pvalue_featureVsHabitat.csv'))
+
+    G = nx.Graph()
+    G.add_nodes_from(features)
+    iu, ju = np.nonzero(np.triu(rng.random((n_nodes, n_nodes)) < edge_prob, 1) & ~missing)
+    for i, j in zip(iu, ju):
+        G.add_edge(features[i], features[j], lr=float(lr[i, j]), p=float(p[i, j]))
+    nx.graphml.write_graphml(G, os.path.join(data, 'pagel_results_as_network_updated.graphml'))
+    return features
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_server(root, kind, port):
+    env = dict(os.environ, PYTHONPATH=REPO, PAGEL2GRAPH_BIND='127.0.0.1:{}'.format(port))
+    if kind == 'gunicorn':
+        cmd = [sys.executable, '-m', 'gunicorn', '-c', os.path.join(REPO, 'gunicorn.conf.py'), 'app:server']
+    else:
+        cmd = [sys.executable, '-c', 'import app; app.init_pool(); app.app.run_server(port={})'.format(port)]
+    # Own process group, so the callback pool goes down with the server.
+    return subprocess.Popen(cmd, cwd=root, env=env, start_new_session=True)
+
+def wait_for(url, proc, timeout=300):
+    start = time.time()
+    while time.time() - start < timeout:
+        if proc is not None and proc.poll() is not None:
+            raise RuntimeError('Server exited with code {}.'.format(proc.returncode))
+        try:
+            urllib.request.urlopen(url, timeout=5).read()
+            return
+        except OSError:
+            time.sleep(0.5)
+    raise RuntimeError('Server at {} did not come up.'.format(url))
+
+#Request body for one callback, as sent by the Dash renderer.
+def callback_payload(callback, features, rng):
+    if callback in ('network', 'paths'):
+        target = rng.choice(features) if callback == 'paths' else None
+        state = [('node-dropdown', 'value', rng.choice(features)),
+                 ('degree', 'value', 2),
+                 ('lr-threshold', 'value', 20.0),
+                 ('p-threshold', 'value', 0.05),
+                 ('path-target-dropdown', 'value', target),
+                 ('path-weight', 'value', 'p'),
+                 ('n-paths', 'value', 3),
+                 ('path-max-hops', 'value', 4)]
+        return {
+            'output': '..network-plot.elements...node-selected.children..',
+            'outputs': [{'id': 'network-plot', 'property': 'elements'},
+                        {'id': 'node-selected', 'property': 'children'}],
+            'inputs': [{'id': 'interactive-button', 'property': 'n_clicks', 'value': 1}],
+            'changedPropIds': ['interactive-button.n_clicks'],
+            'state': [{'id': i, 'property': prop, 'value': value} for i, prop, value in state],
+        }
+    if callback == 'heatmap':
+        return {
+            'output': 'heatmap-graph.figure',
+            'outputs': {'id': 'heatmap-graph', 'property': 'figure'},
+            'inputs': [{'id': 'dataset-select', 'property': 'value', 'value': rng.choice([1, 2])}],
+            'changedPropIds': ['dataset-select.value'],
+        }
+    return {
+        'output': 'histogram-graph.figure',
+        'outputs': {'id': 'histogram-graph', 'property': 'figure'},
+        'inputs': [{'id': 'histogram-button', 'property': 'n_clicks', 'value': 1}],
+        'changedPropIds': ['histogram-button.n_clicks'],
+        'state': [{'id': 'histogram-metric-select', 'property': 'value', 'value': rng.choice([1, 2])},
+                  {'id': 'histogram-y-select', 'property': 'value', 'value': 1}],
+    }
+
+def post(url, payload):
+    request = urllib.request.Request(url, data=json.dumps(payload).encode(),
+                                     headers={'Content-Type': 'application/json'})
+    start = time.perf_counter()
+    with urllib.request.urlopen(request, timeout=600) as response:
+        response.read()
+    return time.perf_counter() - start
+
+def run(url, callback, features, n_requests, concurrency, seed):
+    rng = random.Random(seed)
+    payloads = [callback_payload(callback, features, rng) for _ in range(n_requests)]
+    endpoint = url.rstrip('/') + '/_dash-update-component'
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        futures = [executor.submit(post, endpoint, payload) for payload in payloads]
+    elapsed = time.perf_counter() - start
+
+    latencies = []
+    errors = 0
+    for future in futures:
+        try:
+            latencies.append(future.result())
+        except Exception:
+            errors += 1
+    latencies = np.array(latencies) if latencies else np.array([np.nan])
+
+    print('callback:          {}'.format(callback))
+    print('requests:          {} ({} failed)'.format(n_requests, errors))
+    print('concurrency:       {}'.format(concurrency))
+    print('callbacks/second:  {:.2f}'.format((n_requests - errors) / elapsed))
+    print('latency mean (s):  {:.3f}'.format(np.mean(latencies)))
+    print('latency p50 (s):   {:.3f}'.format(np.percentile(latencies, 50)))
+    print('latency p95 (s):   {:.3f}'.format(np.percentile(latencies, 95)))
+
+if __name__=='__main__':
+    args = argparser.parse_args()
+
+    if args.url is not None:
+        # Node names come from the data directory the server was started in.
+        features = list(pd.read_table('data/efaecium_profile_LR_rerunNA.csv', sep=',', index_col=0).columns)
+        run(args.url, args.callback, features, args.requests, args.concurrency, args.seed)
+        exit()
+
+    with tempfile.TemporaryDirectory() as root:
+        features = make_dataset(root, args.nodes, args.habitats, args.edge_prob, args.seed)
+        port = free_port()
+        url = 'http://127.0.0.1:{}'.format(port)
+        proc = start_server(root, args.server, port)
+        try:
+            wait_for(url + '/', proc)
+            run(url, args.callback, features, args.requests, args.concurrency, args.seed)
+        finally:
+            os.killpg(proc.pid, signal.SIGTERM)
+            proc.wait()
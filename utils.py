@@ -1,23 +1,27 @@
+import heapq
+import itertools as it
+
 import numpy as np
 import pandas as pd
 
 import networkx as nx
 
-def nx_to_dash(G, node):
+def nx_to_dash(G, node, path_nodes=(), path_edges=()):
+    path_nodes = set(path_nodes)
+    path_edges = set(path_edges) | {(v, u) for u, v in path_edges}
     nodes = []
     for n in G.nodes:
-        if n == node:
-            nodes.append({
-                        'data': {'id':n, 'label':n, **G.nodes[n]},
-                        'classes': 'focal',
-            })
-        else:
-            nodes.append({'data': {'id':n, 'label':n, **G.nodes[n]},
-                        'classes':'other',
-            })
+        classes = 'focal' if n == node else 'other'
+        if n in path_nodes:
+            classes += ' path'
+        nodes.append({'data': {'id':n, 'label':n, **G.nodes[n]},
+                    'classes': classes,
+        })
     edges = []
     for e in G.edges:
-        edges.append({'data': {'source': e[0], 'target': e[1], **G.edges[e]}})
+        edges.append({'data': {'source': e[0], 'target': e[1], **G.edges[e]},
+                      'classes': 'path' if (e[0], e[1]) in path_edges else '',
+        })
     return nodes + edges
 
 def neighborhood(G, node, n):
@@ -25,12 +29,283 @@ def neighborhood(G, node, n):
     return [node for node, length in path_lengths.items()
                     if length <= n]
 
-def filter_graph(G, node, d, lr_threshold, p_threshold):
+def threshold_graph(G, lr_threshold, p_threshold):
     edges = []
     for u,v,e in G.edges(data=True):
         if e['lr'] >= lr_threshold and e['p'] <= p_threshold:
             edges.append((u,v))
-    H=G.edge_subgraph(edges)
+    return G.edge_subgraph(edges)
+
+def filter_graph(G, node, d, lr_threshold, p_threshold):
+    H = threshold_graph(G, lr_threshold, p_threshold)
     if node in H.nodes:
         return H.subgraph(neighborhood(H, node, d))
     return G.subgraph([node])
+
+################################################################################
+### Path queries                                                             ###
+################################################################################
+
+#Edge costs for path queries. Strong associations are cheap to traverse, so
+#the shortest path is the strongest chain of associations.
+path_weights = {
+    'hops': lambda e: 1.0,
+    'lr': lambda e: 1.0 / max(e['lr'], 1e-12),
+    'p': lambda e: 1.0 / max(-np.log10(max(e['p'], 1e-300)), 1e-12),
+}
+
+#Integer index of G for path queries, built once when the graph is loaded.
+#nodes[i] is the label of node i and adj[i] maps neighbor index to the ids of
+#the edges between the two nodes. lr, p and costs[weight] are per edge id.
+#Edges are treated as undirected.
+def build_path_index(G):
+    nodes = list(G.nodes)
+    index = {n: i for i, n in enumerate(nodes)}
+    adj = [{} for _ in nodes]
+    edges = []
+    for u, v, e in G.edges(data=True):
+        if u == v:
+            continue
+        i, j = index[u], index[v]
+        adj[i].setdefault(j, []).append(len(edges))
+        adj[j].setdefault(i, []).append(len(edges))
+        edges.append(e)
+    return {
+        'nodes': nodes,
+        'index': index,
+        'adj': adj,
+        'lr': [e['lr'] for e in edges],
+        'p': [e['p'] for e in edges],
+        'costs': {weight: [cost(e) for e in edges] for weight, cost in path_weights.items()},
+    }
+
+#Neighbors in the thresholded graph: returns neighbors(u), a map of neighbor
+#index to the cheapest passing edge cost. Edges are filtered lazily, so a
+#query only pays for the nodes its search reaches.
+def threshold_neighbors(path_index, weight, lr_threshold, p_threshold):
+    adj = path_index['adj']
+    lr = path_index['lr']
+    p = path_index['p']
+    cost = path_index['costs'][weight]
+    cache = {}
+
+    def neighbors(u):
+        if u not in cache:
+            nbrs = {}
+            for v, edge_ids in adj[u].items():
+                passing = [cost[k] for k in edge_ids if lr[k] >= lr_threshold and p[k] <= p_threshold]
+                if passing:
+                    nbrs[v] = min(passing)
+            cache[u] = nbrs
+        return cache[u]
+    return neighbors
+
+#Cheapest path from source to target using at most max_hops edges.
+#Bidirectional Dijkstra over (node, hops) labels: a label is dropped when the
+#node was already reached more cheaply in as few hops. The searches meet on
+#nodes and on edges between settled labels, and stop once the two frontiers
+#together cost at least the best path found. Returns (cost, [node indices])
+#or None when no path exists. neighbors(u) maps neighbor index to edge cost.
+def bidirectional_path(neighbors, source, target, max_hops, blocked_nodes=(), blocked_edges=()):
+    if source == target:
+        return 0.0, [source]
+    if max_hops < 1:
+        return None
+
+    blocked = lambda u, v: v in blocked_nodes or (u, v) in blocked_edges
+    # Per side: settled labels per node as (hops, cost, parent), the fewest
+    # hops settled per node, and the heap of (cost, hops, node, parent).
+    labels = ({source: [(0, 0.0, None)]}, {target: [(0, 0.0, None)]})
+    min_hops = ({source: 0}, {target: 0})
+    heaps = ([], [])
+    counter = it.count()
+    best = [np.inf, None]
+
+    def relax(side, u, idx):
+        h, c, _ = labels[side][u][idx]
+        if h >= max_hops:
+            return
+        for v, w in neighbors(u).items():
+            if blocked(u, v) or min_hops[side].get(v, max_hops + 1) <= h + 1:
+                continue
+            heapq.heappush(heaps[side], (c + w, h + 1, next(counter), v, (u, idx)))
+
+    def meet(side, u, idx):
+        h, c, _ = labels[side][u][idx]
+        other = labels[1 - side]
+        for oidx, (oh, oc, _) in enumerate(other.get(u, [])):
+            if h + oh <= max_hops and c + oc < best[0]:
+                best[:] = [c + oc, (side, u, idx, u, oidx)]
+        if h + 1 > max_hops:
+            return
+        for v, w in neighbors(u).items():
+            if blocked(u, v):
+                continue
+            for oidx, (oh, oc, _) in enumerate(other.get(v, [])):
+                if h + 1 + oh <= max_hops and c + w + oc < best[0]:
+                    best[:] = [c + w + oc, (side, u, idx, v, oidx)]
+
+    for side, node in ((0, source), (1, target)):
+        relax(side, node, 0)
+    meet(0, source, 0)
+
+    while True:
+        tops = [heap[0][0] if heap else np.inf for heap in heaps]
+        if tops[0] + tops[1] >= best[0]:
+            break
+        side = 0 if tops[0] <= tops[1] else 1
+        c, h, _, u, parent = heapq.heappop(heaps[side])
+        if min_hops[side].get(u, max_hops + 1) <= h:
+            continue
+        min_hops[side][u] = h
+        labels[side].setdefault(u, []).append((h, c, parent))
+        idx = len(labels[side][u]) - 1
+        meet(side, u, idx)
+        relax(side, u, idx)
+
+    if best[1] is None:
+        return None
+
+    def trace(side, u, idx):
+        path = []
+        while True:
+            path.append(u)
+            parent = labels[side][u][idx][2]
+            if parent is None:
+                return path
+            u, idx = parent
+
+    side, u, uidx, v, vidx = best[1]
+    first = trace(side, u, uidx)[::-1]
+    second = trace(1 - side, v, vidx)
+    if u == v:
+        second = second[1:]
+    path = first + second
+    if side == 1:
+        path = path[::-1]
+    return best[0], path
+
+#Up to k cheapest loopless paths between two nodes with at most max_hops
+#edges, over the edges of a build_path_index index that pass both thresholds
+#(Yen's algorithm over bidirectional_path). Returns a list of
+#(cost, [node labels]) in increasing cost.
+def k_shortest_paths(path_index, source, target, k=1, weight='hops', max_hops=6,
+                     lr_threshold=-np.inf, p_threshold=np.inf):
+    nodes, index = path_index['nodes'], path_index['index']
+    if source not in index or target not in index:
+        return []
+    neighbors = threshold_neighbors(path_index, weight, lr_threshold, p_threshold)
+    s, t = index[source], index[target]
+    path_cost = lambda path: sum(neighbors(u)[v] for u, v in zip(path, path[1:]))
+
+    first = bidirectional_path(neighbors, s, t, max_hops)
+    if first is None:
+        return []
+    found = [first]
+    candidates = []
+    seen = {tuple(first[1])}
+    while len(found) < k:
+        prev = found[-1][1]
+        for i in range(len(prev) - 1):
+            root = prev[:i + 1]
+            blocked_edges = set()
+            for _, path in found:
+                if path[:i + 1] == root:
+                    blocked_edges.add((path[i], path[i + 1]))
+                    blocked_edges.add((path[i + 1], path[i]))
+            spur = bidirectional_path(neighbors, prev[i], t, max_hops - i,
+                                      blocked_nodes=set(root[:-1]),
+                                      blocked_edges=blocked_edges)
+            if spur is None:
+                continue
+            path = root[:-1] + spur[1]
+            if tuple(path) not in seen:
+                seen.add(tuple(path))
+                heapq.heappush(candidates, (path_cost(path), path))
+        if not candidates:
+            break
+        found.append(heapq.heappop(candidates))
+    return [(cost, [nodes[i] for i in path]) for cost, path in found]
+
+#Nodes and edges covered by a list of paths from k_shortest_paths.
+def path_elements(paths):
+    nodes = set()
+    edges = set()
+    for _, path in paths:
+        nodes.update(path)
+        edges.update(zip(path, path[1:]))
+    return nodes, edges
+
+################################################################################
+### Heatmap clustering                                                       ###
+################################################################################
+
+#Euclidean distance between the rows of X, computed chunk by chunk so only a
+#(chunk x n) block of intermediates is held at once. NaN cells are skipped and
+#the distance is scaled up by the fraction of columns observed (as R's dist).
+#Pairs sharing no observed columns get the largest observed distance.
+def nan_euclidean_distances(X, chunk_size=500):
+    X = np.asarray(X, dtype=float)
+    mask = (~np.isnan(X)).astype(float)
+    X0 = np.where(mask > 0, X, 0.0)
+    X0_sq = X0 ** 2
+    n, p = X.shape
+    D = np.empty((n, n), dtype=np.float32)
+    for start in range(0, n, chunk_size):
+        stop = min(start + chunk_size, n)
+        sq = (X0_sq[start:stop] @ mask.T
+              + mask[start:stop] @ X0_sq.T
+              - 2 * (X0[start:stop] @ X0.T))
+        shared = mask[start:stop] @ mask.T
+        with np.errstate(divide='ignore', invalid='ignore'):
+            block = np.sqrt(np.clip(sq, 0, None) * p / shared)
+        block[shared == 0] = np.nan
+        D[start:stop] = block
+    fill = np.nanmax(D) if np.isfinite(D).any() else 0.0
+    D[np.isnan(D)] = fill
+    np.fill_diagonal(D, 0)
+    #Symmetrize float error from the chunked products.
+    D = np.maximum(D, D.T)
+    return D
+
+#Hierarchical clustering of the rows of df. Returns the leaf order as row
+#labels and the linkage matrix (scipy format) for drawing the dendrogram.
+def cluster_order(df, method='average', chunk_size=500):
+    from scipy.cluster.hierarchy import linkage, leaves_list
+    from scipy.spatial.distance import squareform
+
+    if len(df.index) < 2:
+        return list(df.index), []
+    D = nan_euclidean_distances(df.values, chunk_size=chunk_size)
+    Z = linkage(squareform(D, checks=False), method=method)
+    order = [df.index[i] for i in leaves_list(Z)]
+    return order, Z.tolist()
+
+#Compute row and column orders for a feature vs feature matrix (ava) and its
+#feature vs habitat counterpart (ave). Rows are shared between the two
+#heatmaps, so both are ordered by the clustering of ava's rows.
+def cluster_matrices(ava, ave, method='average', chunk_size=500):
+    rows, rows_linkage = cluster_order(ava, method, chunk_size)
+    ava_cols, ava_cols_linkage = cluster_order(ava.T, method, chunk_size)
+    ave_cols, ave_cols_linkage = cluster_order(ave.T, method, chunk_size)
+    return {
+        'rows': rows,
+        'rows_linkage': rows_linkage,
+        'ava_cols': ava_cols,
+        'ava_cols_linkage': ava_cols_linkage,
+        'ave_cols': ave_cols,
+        'ave_cols_linkage': ave_cols_linkage,
+    }
+
+#Reorder a matrix by a cached order. Labels missing from the order keep their
+#file order at the end, and labels missing from the matrix are dropped.
+def apply_order(df, rows=None, cols=None):
+    if rows is not None:
+        ordered = set(rows)
+        rows = [r for r in rows if r in df.index]
+        df = df.loc[rows + [r for r in df.index if r not in ordered]]
+    if cols is not None:
+        ordered = set(cols)
+        cols = [c for c in cols if c in df.columns]
+        df = df[cols + [c for c in df.columns if c not in ordered]]
+    return df